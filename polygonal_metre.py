@@ -1,17 +1,27 @@
+import os
 import json
 import math
+import subprocess
 import numpy as np
 from pathlib import Path
-from PIL import Image, ImageDraw
-from moviepy.video.VideoClip import TextClip
-from moviepy import AudioFileClip, CompositeVideoClip, VideoClip
+from queue import Queue
+from threading import Event, Semaphore, Thread
+from multiprocessing import Pool
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from moviepy import AudioFileClip, ColorClip, VideoClip
+from moviepy.config import FFMPEG_BINARY
 
 def create_signature_video(json_file:str, output_file="output.mp4", scale=1,
-    font_def:str=None,font_sig:str=None, accent_color=(0,100,255), aa_scale=2):
+    font_def:str=None,font_sig:str=None, accent_color=(0,100,255), aa_scale=2, processes=None):
     ''' Creates a simple time signature visualization with a polygon graphic,
         using a json file with relevant information. Exports a default video
         size of 200x200, can be higher with scale=2, 3 etc...
+        Polygon frames are pre-rendered in parallel over `processes` workers
+        (default: all cores).
     '''
+    fps = 24
+
     # Default fonts
     if font_def is None: font_def = Path(__file__).parent/'fonts/JetBrainsMono-Light.ttf'
     if font_sig is None: font_sig = Path(__file__).parent/'fonts/JetBrainsMono-ExtraBold.ttf'
@@ -20,138 +30,258 @@ def create_signature_video(json_file:str, output_file="output.mp4", scale=1,
     with open(json_file, 'r') as f: data = json.load(f)
 
     # load audio from json
-    audio = AudioFileClip(data['wav'])
-    total_duration = audio.duration  # in seconds
+    with AudioFileClip(data['wav']) as audio: total_duration = audio.duration  # in seconds
 
     # get time segments from json
     time_segments, final_time = _get_segments(data)
 
-    # create clips for each segment
-    clips = []
-    for i,segment in enumerate(time_segments):
-        # encode next segment in segment
-        segment['next'] = time_segments[i + 1] if i + 1 < len(time_segments) else None
-        # clips put on top of each other
-        clips.append(_polygon_clip(segment, scale, accent_color, aa_scale))
-        clips.append(_sig_clip(segment, scale, font_sig))
-        clips.append(_bpm_clip(segment, scale, font_def))
-        clips.append(_next_clip(segment, scale, font_def))
-        clips.append(_bar_clip(segment, scale, accent_color))
-        clips.append(_preview_clip(segment, scale, accent_color, aa_scale))
-    clips = [clip for clip in clips if clip != None]
-
-    # composite and export
+    # video length, resolution
+    duration = min(final_time, total_duration)
+    n_frames = math.ceil(duration*fps)
     resolution = (200*scale, 200*scale)
-    video = CompositeVideoClip(clips, size=resolution).with_duration(min(final_time, total_duration)).with_audio(audio)
-    video.write_videofile(output_file, codec='libx264', audio_codec='aac', fps=24)
+
+    # render polygon frames of all segments in parallel, only a few segments ahead of the
+    # encoder. Workers send each distinct frame once, so memory stays bounded by the looks
+    # of a few segments instead of their length
+    params = [(segment['start'], segment['end'], segment['dur'], segment['sig'][0], segment['bpm'], segment['next'] == None,
+               scale, accent_color, aa_scale, fps, n_frames) for segment in time_segments]
+    ahead = Semaphore((processes or os.cpu_count()) + 1)
+    def throttled():
+        for param in params:
+            ahead.acquire()
+            yield param
+
+    def composited(pool):
+        for segment, (first_frame, looks, index) in zip(time_segments, pool.imap(_render_polygon, throttled())):
+            ahead.release()
+            text = [layer for layer in (_sig_layer(segment, scale, font_sig), _bpm_layer(segment, scale, font_def),
+                                        _next_layer(segment, scale, font_def)) if layer is not None]
+            preview = _preview_clip(segment, scale, accent_color, aa_scale)
+
+            # composite a second of frames at a time, each chunk is freed once written
+            for i in range(0, len(index), fps):
+                frames = looks[index[i:i+fps]]
+                for layer in text: _blit(frames, *layer)
+                # animated layers on top, never spilling into the next segment's frames
+                _stamp_bar(frames, first_frame + i, segment, scale, accent_color, fps)
+                _blend_clip(frames, first_frame + i, preview, fps)
+                yield from frames
+
+    # composite and export chunk by chunk, encoding overlaps with rendering
+    with Pool(processes) as pool:
+        try: _write_video(composited(pool), output_file, data['wav'], duration, fps, resolution)
+        finally: ahead.release(len(params))  # unblock pending submissions if export stopped early
+
+def _write_video(frames, output_file, audio_file, duration, fps, resolution):
+    ''' encodes frames and audio with ffmpeg, frames are piped from a background
+        thread so encoding overlaps with rendering the next frames.'''
+    proc = subprocess.Popen([FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{resolution[0]}x{resolution[1]}', '-r', str(fps), '-i', '-',
+        '-i', str(audio_file), '-map', '0:v', '-map', '1:a', '-t', str(duration),
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', str(output_file)], stdin=subprocess.PIPE)
+
+    # writer thread, keeps draining the queue if ffmpeg exits early so rendering never blocks
+    queue = Queue(maxsize=8)
+    broken = Event()
+    def write():
+        for frame in iter(queue.get, None):
+            if broken.is_set(): continue
+            try: proc.stdin.write(frame)
+            except OSError: broken.set()
+    writer = Thread(target=write)
+    writer.start()
+
+    # frames are passed as zero-copy views, they must not change until written
+    done = False
+    try:
+        for frame in frames:
+            # ffmpeg stopped taking frames, don't render the rest of the song
+            if broken.is_set(): break
+            queue.put(np.ascontiguousarray(frame, dtype=np.uint8).reshape(-1).data)
+        done = True
+    finally:
+        # rendering failed, stop ffmpeg instead of letting it finish a truncated video
+        if not done: proc.kill()
+        queue.put(None)
+        writer.join()
+        try: proc.stdin.close()
+        except OSError: pass
+        if proc.wait() != 0 or broken.is_set(): done = False
+        if not done: Path(output_file).unlink(missing_ok=True)
+    if not done: raise IOError(f"ffmpeg failed to write {output_file}")
+
+def _frame_range(start, end, fps):
+    ''' first and past-the-end index of the video frames shown from start until end, i.e. the
+        frames with start <= k/fps < end as evaluated in float (like moviepy's own test).
+        Segments share their boundary times, so every frame belongs to exactly one segment. '''
+    return _first_frame(start, fps), _first_frame(end, fps)
+
+def _first_frame(time, fps):
+    ''' first video frame index k with k/fps >= time, ceil(time*fps) corrected for rounding. '''
+    k = math.ceil(time*fps)
+    if k/fps < time: return k + 1
+    if (k - 1)/fps >= time: return k - 1
+    return k
+
+def _clip_time(k, fps, start, duration):
+    ''' local time of video frame k in a clip, kept inside [0, duration) against float rounding. '''
+    return min(max(k/fps - start, 0.0), math.nextafter(duration, 0))
+
+def _blend_clip(frames, first_frame, clip, fps):
+    ''' alpha blends an RGBA or masked clip onto a run of pre-rendered frames starting at video
+        frame first_frame, only where the clip and the run overlap.'''
+    if clip is None: return
+    clip_first, clip_end = _frame_range(clip.start, clip.end, fps)
+    for k in range(max(clip_first, first_frame), min(clip_end, first_frame + len(frames))):
+        t = _clip_time(k, fps, clip.start, clip.duration)
+        layer = clip.get_frame(t)
+        if clip.mask is not None: alpha = (clip.mask.get_frame(t)*255).round().astype(np.uint8)
+        else: alpha = layer[..., 3]
+        _blend(frames[k - first_frame], layer[..., :3], alpha)
+
+def _blit(frames, image, position):
+    ''' blends a static RGBA image over a run of frames at position (x, y), clipped to the frame. '''
+    x, y = position
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + image.shape[1], frames.shape[2]), min(y + image.shape[0], frames.shape[1])
+    if x0 >= x1 or y0 >= y1: return
+    image = image[y0-y:y1-y, x0-x:x1-x]
+    _blend(frames[:, y0:y1, x0:x1], image[..., :3], image[..., 3])
+
+def _blend(frame, rgb, alpha):
+    ''' rounded integer alpha blend of uint8 rgb over uint8 frame(s), in place. '''
+    alpha = alpha.astype(np.uint16)[..., None]
+    frame[...] = (rgb*alpha + frame*(255 - alpha) + 127) // 255
 
 def _get_segments(data):
-    current_time = 0.0
-    segments = []
-    for i,segment in enumerate(data['map']):
-        sig = segment['sig']
-        bpm = segment['bpm']
-        bars = segment['bars']
-
-        beats_per_bar = sig[0]
-        bar_duration = beats_per_bar * 60 / bpm
-        segment_duration = bars * bar_duration
-        segment_end = current_time + segment_duration
-
-        # save basic info about this segment in the previous segment
-        if segments: segments[i-1]['next'] = {'sig': sig,'bpm': bpm}
-
-        # save calculated segment info & go to start of next segment
-        segments.append({'start': current_time,'end': segment_end,'dur': segment_duration,'sig': sig,'bpm': bpm, 'next':None})
-        current_time += segment_duration
-
-    # dummy final bar & final time
-    dummy = {'start': current_time,'end': current_time+bar_duration,'dur': bar_duration,'sig': sig,'bpm': bpm, 'next':None}
-    segments[-1]['next'] = dummy
-    segments.append(dummy)
-    final_time = current_time + segment_duration
+    m = data['map']
+    sig0 = np.fromiter((segment['sig'][0] for segment in m), dtype=np.float64, count=len(m))
+    bpm = np.fromiter((segment['bpm'] for segment in m), dtype=np.float64, count=len(m))
+    bars = np.fromiter((segment['bars'] for segment in m), dtype=np.float64, count=len(m))
+
+    # segment durations and boundary times in one pass
+    bar_durations = sig0 * 60 / bpm
+    durations = bars * bar_durations
+    bounds = np.zeros(len(durations) + 1)
+    np.cumsum(durations, out=bounds[1:])
+
+    # dummy final bar, repeating the last signature
+    bounds = np.append(bounds, bounds[-1] + bar_durations[-1])
+    starts, ends = bounds[:-1].tolist(), bounds[1:].tolist()
+    durations = np.append(durations, bar_durations[-1]).tolist()
+    sigs = [segment['sig'] for segment in m] + [m[-1]['sig']]
+    bpms = [segment['bpm'] for segment in m] + [m[-1]['bpm']]
+
+    # calculated segment info, each segment linked to the next one
+    segments = [{'start': start,'end': end,'dur': dur,'sig': sig,'bpm': bpm, 'next':None}
+                for start, end, dur, sig, bpm in zip(starts, ends, durations, sigs, bpms)]
+    for segment, next_segment in zip(segments, segments[1:]): segment['next'] = next_segment
+    final_time = segments[-1]['end']
     return segments, final_time
 
-def _sig_clip(segment, scale, font_sig):
-    ''' creates clip with the time signature'''
+def _sig_layer(segment, scale, font_sig):
+    ''' creates layer with the time signature'''
     sig_text = f"{segment['sig'][0]}\n{segment['sig'][1]}"
-    clip = TextClip(
+    image = _text_image(
         text=sig_text,
         font_size=25*scale,
-        color='white',
         font=font_sig,
         text_align='center',
-        method='label',
-    ).with_duration(segment['dur']).with_start(segment['start'])
-    return clip.with_position(((100*scale-clip.w//2),(100*scale-clip.h//2)))
+    )
+    return image, ((100*scale-image.shape[1]//2),(100*scale-image.shape[0]//2))
 
-def _bpm_clip(segment, scale, font_def):
-    ''' creates clip with the BPM'''
+def _bpm_layer(segment, scale, font_def):
+    ''' creates layer with the BPM'''
     sig_text = f"BPM {segment['bpm']}"
-    return TextClip(
+    return _text_image(
         text=sig_text,
         font_size=10*scale,
-        color='white',
         font=font_def,
         text_align='left',
-        method='label',
-        bg_color='black'
-    ).with_position((3*scale,0)).with_duration(segment['dur']).with_start(segment['start'])
+        bg_color=(0,0,0,255)
+    ), (3*scale,0)
 
-def _next_clip(segment, scale, font_def):
-    ''' creates clip with the next time signature'''
+def _next_layer(segment, scale, font_def):
+    ''' creates layer with the next time signature'''
     # No preview if last or second to last segment
     if (segment.get('next') == None) or (segment.get('next').get('next') == None): return None
 
     # text gen
     sig_text = f"{segment['next']['sig'][0]}/{segment['next']['sig'][1]} NEXT"
-    return TextClip(
+    return _text_image(
         text=sig_text,
         font_size=10*scale,
         text_align='right',
-        horizontal_align='right',
-        color='white',
         font=font_def,
-        method='caption',
-        size=(63*scale, None)
-    ).with_position((134*scale, 0)).with_duration(segment['dur']).with_start(segment['start'])
-
-def _bar_clip(segment, scale, accent_color):
-    ''' creates clip showing progress to next time signature'''
+        width=63*scale
+    ), (134*scale, 0)
+
+@lru_cache(maxsize=None)
+def _font(font, font_size):
+    ''' loads a font once per file and size. '''
+    return ImageFont.truetype(str(font), font_size)
+
+@lru_cache(maxsize=None)
+def _text_image(text, font, font_size, text_align='left', width=None, bg_color=(0,0,0,0)):
+    ''' rasterizes white text with PIL into an RGBA array, optionally aligned in a fixed width box.
+        Cached, so repeated signatures and tempos reuse the same read-only array. '''
+    font = _font(font, font_size)
+    # bbox can be fractional for centered/right aligned text, round it up to whole pixels
+    _, _, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).multiline_textbbox((0, 0), text, font=font, align=text_align)
+    right, bottom = math.ceil(right), math.ceil(bottom)
+    width = right if width is None else width
+    x = width - right if text_align == 'right' else (width - right) // 2 if text_align == 'center' else 0
+
+    img = Image.new("RGBA", (width, bottom), bg_color)
+    ImageDraw.Draw(img).multiline_text((x, 0), text, font=font, fill='white', align=text_align)
+    image = np.array(img)
+    image.flags.writeable = False
+    return image
+
+def _stamp_bar(frames, first_frame, segment, scale, accent_color, fps):
+    ''' draws the progress to the next time signature straight into a run of the segment's frames. '''
     # No preview if last or second to last segment
-    if (segment.get('next') == None) or (segment.get('next').get('next') == None): return None
-
-    # polygon
-    def make_frame(t):
-        img_size = 200 * scale
-        img = Image.new("RGBA", (img_size, img_size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-
-        fraction = t/segment['dur']
-        corners = [((150+fraction*47)*scale,14*scale),(197*scale,17*scale)]
-        color = accent_color if t > segment['dur'] - segment['sig'][0] * 60 / segment['bpm'] else (255,255,255)
-        draw.rectangle(corners, color)
-        return np.array(img)
+    if (segment.get('next') == None) or (segment.get('next').get('next') == None): return
 
-    return VideoClip(make_frame, duration=segment['dur']).with_start(segment['start'])
+    # white bar, accent colored during the last bar of the segment
+    colors = np.array([(255,255,255), accent_color], dtype=np.uint8)
+    last_bar = segment['dur'] - segment['sig'][0] * 60 / segment['bpm']
 
+    # opaque rectangle, only its row band is touched (the bar shrinks from the left)
+    for i, frame in enumerate(frames):
+        t = _clip_time(first_frame + i, fps, segment['start'], segment['dur'])
+        x0 = int((150+t/segment['dur']*47)*scale)
+        frame[14*scale:17*scale+1, x0:197*scale+1] = colors[int(t > last_bar)]
 
-def _polygon_clip(segment, scale, accent_color, aa_scale):
-    ''' creates clip with the polygon visual.'''
-    n_beats = segment['sig'][0]
-    bpm = segment['bpm']
-    dur = segment['dur']
 
-    polygon_clip = make_polygon_filler(
+def _render_polygon(params):
+    ''' renders the polygon of a segment on the video's frame grid (runs in a worker).
+        Returns the first frame index, the distinct frames, and which of them each frame shows.'''
+    start, end, dur, n_beats, bpm, last, scale, accent_color, aa_scale, fps, n_frames = params
+    polygon = make_polygon_filler(
         beats_per_bar=n_beats,
         bpm=bpm,
         bar_duration=dur,
         scale=scale,
         accent_color=accent_color,
         aa_scale=aa_scale,
-        last=(segment['next'] == None)
-    ).with_start(segment['start'])
-    return polygon_clip
+        last=last
+    )
+
+    # first and last video frame inside the segment, so frames line up with the export
+    # (nothing past the end of the video is rendered)
+    first_frame, end_frame = _frame_range(start, end, fps)
+    end_frame = min(end_frame, n_frames)
+
+    # the filler hands out the same array for repeated looks, keep each one once
+    looks = {}
+    index = np.empty(max(end_frame - first_frame, 0), dtype=np.intp)
+    for i,k in enumerate(range(first_frame, end_frame)):
+        frame = polygon.get_frame(_clip_time(k, fps, start, dur))
+        index[i] = looks.setdefault(id(frame), (len(looks), frame))[0]
+    frames = np.empty((len(looks), 200*scale, 200*scale, 3), dtype=np.uint8)
+    for j, frame in looks.values(): frames[j] = frame
+    return first_frame, frames, index
 
 def _preview_clip(segment, scale, accent_color, aa_scale):
     ''' creates clip with the next time signature's polygon.'''
@@ -163,75 +293,142 @@ def _preview_clip(segment, scale, accent_color, aa_scale):
     preview_start = preview_end - beats_per_bar * 60 / segment['bpm']
 
 
-    def make_frame(t):
-        img_size = 200 * scale * aa_scale
-        img = Image.new("RGBA", (img_size, img_size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        cx, cy, radius = img_size // 2, img_size // 2, img_size * 0.4
-
-        # polygon
-        angles = np.linspace(-0.5*np.pi, 1.5 * np.pi, segment['next']['sig'][0], endpoint=False)
-        points = [(cx + radius * np.cos(a), cy + radius * np.sin(a)) for a in angles]
-        opacity = (math.pi**-1)*math.acos(1-2*(t/(preview_end-preview_start)))
-        draw.polygon(points, outline=(*accent_color, int(255*opacity)), width=scale*aa_scale)
+    # polygon geometry, constant for the whole clip
+    img_size = 200 * scale * aa_scale
+    cx, cy, radius = img_size // 2, img_size // 2, img_size * 0.4
+    cos_a, sin_a = _corner_directions(segment['next']['sig'][0])
+    points = np.column_stack([cx + radius * cos_a, cy + radius * sin_a])
 
-        # Anti-Alias by resizing back to standard
-        if aa_scale == 1: return np.array(img)
-        return np.array(img.resize((int(200 * scale), int(200 * scale)), Image.LANCZOS))
+    # outline is static, rasterize and anti-alias it once as an alpha mask
+    outline = Image.new("L", (img_size, img_size), 0)
+    ImageDraw.Draw(outline).polygon(points.ravel().tolist(), outline=255, width=scale*aa_scale)
+    outline_mask = (_box_mean(outline, aa_scale)[..., 0] / 255).astype(np.float32)
 
-    return VideoClip(make_frame, duration=preview_end - preview_start).with_start(preview_start)
-
-def make_polygon_filler(beats_per_bar, bpm, bar_duration, scale, accent_color, aa_scale, last=False, fade_beats=3):
-    ''' logic for the polygon slice filling. '''
+    def make_mask(t):
+        # polygon, only the opacity changes per frame
+        opacity = (math.pi**-1)*math.acos(1-2*(t/(preview_end-preview_start)))
+        return outline_mask * opacity
+
+    # plain accent color, shown through the outline mask
+    duration = preview_end - preview_start
+    mask = VideoClip(make_mask, is_mask=True, duration=duration)
+    color = ColorClip((200*scale, 200*scale), color=accent_color, duration=duration)
+    return color.with_mask(mask).with_start(preview_start)
+
+def make_polygon_filler(beats_per_bar, bpm, bar_duration, scale, accent_color, aa_scale, last=False, fade_beats=3, sub_beats=8):
+    ''' logic for the polygon slice filling.
+        Frames are rendered once per `sub_beats` step of a beat and shared between
+        bars, copy them if you need to modify them. '''
     beat_duration = 60 / bpm
 
-    def make_frame(t):
-        img_size = 200 * scale * aa_scale
-        img = Image.new("RGB", (img_size, img_size), (0, 0, 0))
-        draw = ImageDraw.Draw(img)
-
-        # polygon properties
-        cx, cy = img_size // 2, img_size // 2
-        radius = img_size * 0.4
+    # polygon properties, constant for the whole clip
+    img_size = 200 * scale * aa_scale
+    cx, cy = img_size // 2, img_size // 2
+    radius = img_size * 0.4
+    cos_a, sin_a = _corner_directions(beats_per_bar)
+
+    # inner polygon, outer outline and top black polygon coordinates
+    inner_radius = radius - 5*scale*aa_scale
+    points = np.column_stack([cx + inner_radius * cos_a, cy + inner_radius * sin_a])
+    outer_points = np.column_stack([cx + radius * cos_a, cy + radius * sin_a])
+    top_points = np.column_stack([cx + radius * 0.5 * cos_a, cy + radius * 0.5 * sin_a])
+
+    # outer outline is static, draw it once on a base image
+    base = Image.new("RGB", (img_size, img_size), (0, 0, 0))
+    ImageDraw.Draw(base).polygon(outer_points.ravel().tolist(), outline="white",width=scale*aa_scale)
+    base = np.array(base)
+
+    # slices covering every pixel, top black polygon punched out last. Neighbouring slices
+    # share their edge pixels, so pixels are grouped by the set of slices covering them
+    covered = np.empty((img_size, img_size, beats_per_bar), dtype=bool)
+    for i in range(beats_per_bar):
+        polygon_slice = np.vstack([(cx, cy), points[[i, (i + 1) % beats_per_bar]]])
+        mask = Image.new("1", (img_size, img_size), 0)
+        ImageDraw.Draw(mask).polygon(polygon_slice.ravel().tolist(), fill=1)
+        covered[..., i] = np.asarray(mask)
+    top = Image.new("1", (img_size, img_size), 0)
+    ImageDraw.Draw(top).polygon(top_points.ravel().tolist(), fill=1)
+    covered[np.asarray(top)] = False
+    keys = np.packbits(covered, axis=-1).view(np.dtype((np.void, (beats_per_bar + 7) // 8)))
+    _, first, groups = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+    members, groups = covered.reshape(-1, beats_per_bar)[first], groups.reshape(img_size, img_size)
+    drawable = np.flatnonzero(members.any(axis=1))  # pixels outside all slices only show the base
+    members = members[drawable]
+
+    # share of each output pixel covered by each group (and by the base image beneath it),
+    # so a whole frame is one matrix product at output resolution: fill and anti-alias fused
+    onehot = groups[..., None] == drawable
+    coverage = _box_mean(onehot, aa_scale).reshape(-1, len(members)).astype(np.float32)
+    base_ds = _box_mean(base, aa_scale).astype(np.float32)
+    overlap = onehot & base.any(axis=-1)[..., None]
+    under = None
+    if overlap.any():
+        under = np.stack([_box_mean(base * onehot[..., [i]], aa_scale) for i in range(len(members))]).astype(np.float32)
+    out_shape = base_ds.shape
+
+    # slices are painted in order, a group shows its last drawn slice
+    painted = np.arange(1, beats_per_bar + 1) * members
+
+    # rendered frames cached per sub-beat, sub-beats with the same slice colors share a frame
+    cache = {}
+    looks = {}
+    previous = [None, None]
+
+    def render(beat_pos):
+        colors, active = _slice_colors(beat_pos, beats_per_bar, accent_color, last, fade_beats)
+        look = colors.tobytes() + active.tobytes()
+        if look not in looks:
+            order = painted * active
+            shown, drawn = order.argmax(axis=1), (order.max(axis=1) > 0).astype(np.float32)
+            frame = base_ds + (coverage @ (colors[shown] * drawn[:, None])).reshape(out_shape)
+            if under is not None: frame -= np.tensordot(drawn, under, axes=1)
+            looks[look] = frame.round().astype(np.uint8)
+        return looks[look]
 
-        # get current beat (float for sub-beat precision) and beat-phase
+    def make_frame(t):
+        # get current beat, quantized to sub-beats, the look only repeats after the first bar
         beat_pos = (t % bar_duration) / beat_duration
-        beat_phase = ((t % bar_duration) / beat_duration) % beats_per_bar
-
-        # inner polygon coordinates
-        angles = np.linspace(-0.5*np.pi, 1.5 * np.pi, beats_per_bar, endpoint=False)
-        points = [(cx + (radius-5*scale*aa_scale) * np.cos(a), cy + (radius-5*scale*aa_scale) * np.sin(a)) for a in angles]
-
-        # outer outline
-        outer_points = [(cx + radius * np.cos(a), cy + radius * np.sin(a)) for a in angles]
-        draw.polygon(outer_points, outline="white",width=scale*aa_scale)
-
-        # fading slices
-        for i in range(beats_per_bar):
-            beats_ago = beat_phase - i
-            if (beat_pos - i < 0) and not last:
-                 continue
-            if beats_ago < 0:
-                beats_ago += beats_per_bar
-
-            if (beats_ago < fade_beats) or last:
-                x = 1-(beats_ago / fade_beats)
-                fade = x  # fade function,fade=(1->0) x=(1->0)
-                brightness = int(255 * fade)
-                color = (brightness, brightness, brightness)
-                if i == 0:
-                    color = (int(accent_color[0]* fade),int(accent_color[1]* fade),int(accent_color[2]* fade))
-                if last:
-                    color = (0,0,0)
-                polygon_slice = [(cx, cy), points[i], points[(i + 1) % beats_per_bar]]
-                draw.polygon(polygon_slice, fill=color)
-
-        # top black polyon
-        outer_points = [(cx + radius * 0.5 * np.cos(a), cy + radius * 0.5 * np.sin(a)) for a in angles]
-        draw.polygon(outer_points, fill='black')
-
-        # Anti-Alias by resizing back to standard
-        if aa_scale == 1: return np.array(img)
-        return np.array(img.resize((int(200 * scale), int(200 * scale)), Image.LANCZOS))
-
-    return VideoClip(make_frame, duration=bar_duration)
\ No newline at end of file
+        step = int(beat_pos * sub_beats)
+        key = (step % (beats_per_bar * sub_beats), step < beats_per_bar * sub_beats)
+
+        # unchanged since the previous frame, return it as-is
+        if key == previous[0]: return previous[1]
+        if key not in cache: cache[key] = render(step / sub_beats)
+        previous[:] = key, cache[key]
+        return previous[1]
+
+    return VideoClip(make_frame, duration=bar_duration)
+
+def _slice_colors(beat_pos, beats_per_bar, accent_color, last, fade_beats):
+    ''' float32 fill color of every polygon slice at a beat position, and which slices are drawn. '''
+    i = np.arange(beats_per_bar)
+
+    # beat-phase within the bar, and how many beats ago each slice was hit
+    beat_phase = beat_pos % beats_per_bar
+    beats_ago = (beat_phase - i) % beats_per_bar
+
+    # slices are drawn once reached and while fading, or all (in black) if last
+    active = last | ((beat_pos >= i) & (beats_ago < fade_beats))
+
+    # fade function,fade=(1->0) x=(1->0), white slices but the accented first one
+    fade = 1 - beats_ago / fade_beats
+    tint = np.full((beats_per_bar, 3), 255.0)
+    tint[0] = accent_color
+    colors = np.trunc(fade[:, None] * tint) * (active & (not last))[:, None]
+    return colors.astype(np.float32), active.astype(np.float32)
+
+def _corner_directions(n_corners):
+    ''' float32 cos/sin of the polygon corner angles, starting at the top and going clockwise. '''
+    angles = np.linspace(-0.5*np.pi, 1.5 * np.pi, n_corners, endpoint=False)
+    return np.cos(angles).astype(np.float32), np.sin(angles).astype(np.float32)
+
+def _box_mean(img, aa_scale):
+    ''' float32 mean of every aa_scale x aa_scale pixel block, with a trailing channel axis.
+        Summed in integers over the block's strided offsets, much faster than a float64 mean. '''
+    arr = np.asarray(img)
+    if arr.ndim == 2: arr = arr[..., None]
+    h, w = arr.shape[0] - arr.shape[0] % aa_scale, arr.shape[1] - arr.shape[1] % aa_scale
+    total = np.zeros((h // aa_scale, w // aa_scale, arr.shape[2]), dtype=np.uint32)
+    for dy in range(aa_scale):
+        for dx in range(aa_scale): total += arr[dy:h:aa_scale, dx:w:aa_scale]
+    return total * np.float32(1 / aa_scale**2)